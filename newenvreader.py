@@ -2,12 +2,48 @@
 This module provides utility functions for reading environment variables.
 """
 
+import codecs
+import copy
 import os
+import time
 from configparser import ConfigParser, MissingSectionHeaderError
-from typing import TypeVar, Optional
+from types import MappingProxyType
+from typing import Callable, Mapping, TypeVar, Optional
 
 T = TypeVar("T")
 
+# ASCII characters removed by str.strip() that can occur within a line
+_BLANK_CHARS = b" \t\v\f\x1c\x1d\x1e\x1f"
+_QUOTE_CHARS = b"'\""
+
+_MISSING = object()
+
+# Parsed configuration files keyed by path, see _parse_cached
+_PARSE_CACHE: dict[
+    str, tuple[tuple[int, int, int, int], dict[str, str] | ValueError]
+] = {}
+
+# Files modified within this many nanoseconds are not cached, covering the
+# coarsest common filesystem timestamp resolution (2 s on FAT)
+_RACY_NS = 2_000_000_000
+
+# Indirection for the working directory lookup, can be replaced in tests
+_cwd_fn = os.getcwd
+
+# Common spellings of boolean values, checked before falling back to lower()
+_BOOL_TRUE = frozenset(
+    {
+        "yes", "Yes", "YES", "true", "True", "TRUE", "t", "T",
+        "1", "on", "On", "ON", "y", "Y",
+    }
+)
+_BOOL_FALSE = frozenset(
+    {
+        "no", "No", "NO", "false", "False", "FALSE", "f", "F",
+        "0", "off", "Off", "OFF", "n", "N", "",
+    }
+)
+
 
 def clean_env_var(value: str) -> str:
     """Clean an environment variable value.
@@ -29,19 +65,65 @@ def parse_env_file(path: str) -> dict[str, str]:
 
     :param path: Path to the .env file.
     :type path: str
+    :raises ValueError: If a line has no ``=`` separator.
     :return: A dictionary of environment variables.
     :rtype: dict
     """
+    with open(path, "rb") as file:
+        data = file.read()
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8) :]
+
     env_file_val = {}
-    with open(path, "r", encoding="utf-8") as file:
-        for line in file:
-            line = line.strip()
-            if not line:
+    for line in data.splitlines():
+        if not line.isascii():
+            # Non-ASCII lines may contain Unicode whitespace (e.g. NBSP), which
+            # only str.strip() handles
+            text = line.decode("utf-8").strip()
+            if not text or text[0] == "#":
                 continue
-
-            key, value = line.split("=", maxsplit=1)
-            key = key.strip()
-            env_file_val[key] = clean_env_var(value.strip())
+            key, sep, value = text.partition("=")
+            if not sep:
+                raise ValueError(f"Invalid .env file: Invalid line {text!r}")
+            env_file_val[key.rstrip()] = clean_env_var(value.lstrip())
+            continue
+
+        # Locate key and value by index and slice each only once
+        size = len(line)
+        start = 0
+        while start < size and line[start] in _BLANK_CHARS:
+            start += 1
+        # Skip blank lines and comment lines
+        if start == size or line[start] == 0x23:  # "#"
+            continue
+
+        equals = line.find(b"=", start)
+        if equals == -1:
+            line = line[start:].rstrip().decode("utf-8")
+            raise ValueError(f"Invalid .env file: Invalid line {line!r}")
+
+        key_end = equals
+        while key_end > start and line[key_end - 1] in _BLANK_CHARS:
+            key_end -= 1
+        key = line[start:key_end]
+
+        value_start = equals + 1
+        while value_start < size and line[value_start] in _BLANK_CHARS:
+            value_start += 1
+        value_end = size
+        while value_end > value_start and line[value_end - 1] in _BLANK_CHARS:
+            value_end -= 1
+
+        # Strip surrounding quotes only when they match and enclose a value
+        if (
+            value_end - value_start > 2
+            and line[value_start] in _QUOTE_CHARS
+            and line[value_end - 1] == line[value_start]
+        ):
+            value_start += 1
+            value_end -= 1
+        value = line[value_start:value_end]
+        env_file_val[key.decode("utf-8")] = value.decode("utf-8")
 
     return env_file_val
 
@@ -80,18 +162,25 @@ def search_env_file(start_path: str) -> str:
     """
     current_dir = os.path.abspath(start_path)
 
-    for root, _, files in os.walk(current_dir):
-        for file in files:
-            # Check if it's file ending with .env or is settings.ini
-            if file.endswith(".env") or file == "settings.ini":
-                return os.path.join(root, file)
-
-    parent_dir = os.path.dirname(current_dir)
-    if parent_dir == current_dir:
-        # Reached the root directory, file not found
-        raise FileNotFoundError("No .env file found")
-
-    return search_env_file(parent_dir)
+    while True:
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    # Check if it's file ending with .env or is settings.ini
+                    name = entry.name
+                    if (name.endswith(".env") or name == "settings.ini") and (
+                        entry.is_file()
+                    ):
+                        return entry.path
+        except OSError:
+            # Unreadable directory, continue with the parent directory
+            pass
+
+        parent_dir = os.path.dirname(current_dir)
+        if parent_dir == current_dir:
+            # Reached the root directory, file not found
+            raise FileNotFoundError("No .env file found")
+        current_dir = parent_dir
 
 
 def cast_bool(value: str) -> bool:
@@ -105,37 +194,124 @@ def cast_bool(value: str) -> bool:
     if not isinstance(value, str):
         return bool(value)
 
-    if value.lower() in ("yes", "true", "t", "1", "on", "y"):
+    if value in _BOOL_TRUE:
+        return True
+    if value in _BOOL_FALSE:
+        return False
+
+    # Only normalise case when the exact spelling is not known
+    value = value.lower()
+    if value in _BOOL_TRUE:
         return True
-    if value.lower() in ("no", "false", "f", "0", "off", "n", ""):
+    if value in _BOOL_FALSE:
         return False
 
     raise ValueError("Invalid boolean value")
 
 
-def load_env() -> dict[str, str]:
+def _parse_cached(
+    path: str, parse: Callable[[str], dict[str, str]]
+) -> dict[str, str]:
+    """Parse a configuration file, reusing the previous result if unchanged.
+
+    The file is considered unchanged if its inode, size, modification time and
+    change time match the cached entry. Files modified shortly before parsing
+    are not cached, as a rewrite within the same timestamp tick could not be
+    told apart. Invalid files are cached as well, so the error is raised
+    again without re-parsing. The returned dictionary is shared and must not
+    be modified.
+
+    :param path: Path to the configuration file.
+    :type path: str
+    :param parse: The function used to parse the file.
+    :type parse: Callable[[str], dict[str, str]]
+    :raises ValueError: If the file is invalid.
+    :return: A dictionary of environment variables.
+    :rtype: dict[str, str]
+    """
+    stat = os.stat(path)
+    file_id = (stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+    cached = _PARSE_CACHE.get(path)
+    if cached is not None and cached[0] == file_id:
+        result = cached[1]
+        if isinstance(result, ValueError):
+            # Raise a fresh copy so the cached error never gains a traceback
+            # or context from being raised
+            error = copy.copy(result)
+            if result.__cause__ is not None:
+                error.__cause__ = result.__cause__
+            raise error
+        return result
+
+    # Like git's "racily clean" check, don't trust a file that may still be
+    # modified within the timestamp granularity of its current mtime
+    racy = time.time_ns() - max(stat.st_mtime_ns, stat.st_ctime_ns) < _RACY_NS
+    try:
+        env_file_val = parse(path)
+    except ValueError as err:
+        if not racy:
+            # Cache a copy without the traceback, which keeps the parser's
+            # frames and the file contents alive
+            cached_err = copy.copy(err)
+            if err.__cause__ is not None:
+                cached_err.__cause__ = copy.copy(err.__cause__)
+            _PARSE_CACHE[path] = (file_id, cached_err)
+        raise
+    if not racy:
+        _PARSE_CACHE[path] = (file_id, env_file_val)
+    return env_file_val
+
+
+def load_env(cwd: Optional[str] = None) -> dict[str, str]:
     """Load environment variables from the .env file or the system environment.
 
+    :param cwd: Directory to start searching for the configuration file from,
+        defaults to the current working directory
+    :type cwd: Optional[str], optional
     :raises KeyError: If a required environment variable is not found.
     :return: A dictionary of environment variables.
     :rtype: dict[str, str]
     """
-    env = {}
-    for key, value in os.environ.items():
-        env[key] = value
+    env = dict(os.environ)
 
     try:
-        found_env_path = search_env_file(os.getcwd())
+        found_env_path = search_env_file(cwd or _cwd_fn())
         if found_env_path.endswith(".ini"):
-            env.update(parse_ini_file(found_env_path))
+            env.update(_parse_cached(found_env_path, parse_ini_file))
         else:
-            env.update(parse_env_file(found_env_path))
+            env.update(_parse_cached(found_env_path, parse_env_file))
     except FileNotFoundError:
         pass
     return env
 
 
-loaded_env = load_env()
+# Snapshot of the environment used by get_env, set by load()
+loaded_env: Mapping[str, str]
+
+
+def load(cwd: Optional[str] = None) -> None:
+    """Load the environment snapshot used by :func:`get_env`.
+
+    The snapshot is exposed as a read-only mapping in ``loaded_env``.
+
+    :param cwd: Directory to start searching for the configuration file from,
+        defaults to the current working directory
+    :type cwd: Optional[str], optional
+    """
+    global loaded_env
+    loaded_env = MappingProxyType(load_env(cwd))
+
+
+def refresh() -> None:
+    """Reload the environment snapshot used by :func:`get_env`.
+
+    Call this after modifying ``os.environ`` or the configuration file at
+    runtime so that the changes are picked up.
+    """
+    load()
+
+
+load()
 
 
 def get_env(key: str, cast: type[T] = str, default: Optional[T] = None) -> T:
@@ -151,13 +327,17 @@ def get_env(key: str, cast: type[T] = str, default: Optional[T] = None) -> T:
     :return: The environment variable value.
     :rtype: str
     """
-    try:
-        val = loaded_env[key]
-    except KeyError as err:
-        if default is not None:
+    val = loaded_env.get(key, _MISSING)
+    if val is _MISSING:
+        # Fall back to variables set after the snapshot was taken
+        val = os.environ.get(key, _MISSING)
+        if val is _MISSING:
+            if default is None:
+                raise KeyError(f"Environment variable {key} is not found")
+            if cast is bool and not isinstance(default, str):
+                # Non-string defaults such as 0 or 1 need no parsing
+                return bool(default)
             val = default
-        else:
-            raise KeyError(f"Environment variable {key} is not found") from err
 
     if cast is bool:
         return cast_bool(val)
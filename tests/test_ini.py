@@ -1,18 +1,14 @@
-import importlib
 import os
 import tempfile
 import unittest
+from pathlib import Path
 from unittest.mock import patch
 
 import newenvreader
 
 
 class TestEnvParsing(unittest.TestCase):
-    def setUp(self):
-        os.environ["MY_VAR"] = "12121"
-        os.environ["KEY_NOT_OVERRIDDEN_BY_ENV"] = "Normal"
-
-        env_data = """
+    _ENV_BYTES = b"""
         [settings]
         STR_VAL=value1
         StrVal=value2
@@ -40,13 +36,20 @@ class TestEnvParsing(unittest.TestCase):
         KEY_NOT_OVERRIDDEN_BY_ENV=Overide
         """
 
+    def setUp(self):
+        environ = patch.dict(
+            os.environ, {"MY_VAR": "12121", "KEY_NOT_OVERRIDDEN_BY_ENV": "Normal"}
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+
         self.temp_dir = tempfile.TemporaryDirectory()
         file_path = os.path.join(self.temp_dir.name, "settings.ini")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(env_data)
+        Path(file_path).write_bytes(self._ENV_BYTES)
 
-        with patch("os.getcwd", return_value=self.temp_dir.name):
-            importlib.reload(newenvreader)
+        newenvreader._cwd_fn = lambda: self.temp_dir.name
+        self.addCleanup(setattr, newenvreader, "_cwd_fn", os.getcwd)
+        newenvreader.load()
         self.file_path = file_path
 
     def test_env_normal(self):
@@ -89,8 +92,6 @@ class TestEnvParsing(unittest.TestCase):
         assert newenvreader.get_env("KEY_NOT_OVERRIDDEN_BY_ENV") == "Overide"
 
     def tearDown(self):
-        del os.environ["MY_VAR"]
-        del os.environ["KEY_NOT_OVERRIDDEN_BY_ENV"]
         os.remove(self.file_path)
         self.temp_dir.cleanup()
 
@@ -1,124 +1,241 @@
-import importlib
 import os
 import tempfile
 import unittest
+from configparser import MissingSectionHeaderError
+from pathlib import Path
 from unittest.mock import patch
 
 import newenvreader
 
 
 class TestFindAndReadEnv(unittest.TestCase):
-    def setUp(self):
-        os.environ["MY_VAR"] = "12121"
-        self.env_data = "VAR1=value1\nVAR2=value2\nVAR3=12121\n"
+    env_data = "VAR1=value1\nVAR2=value2\nVAR3=12121\n"
 
-        self.temp_dir = tempfile.TemporaryDirectory()
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.temp_dir.cleanup)
+        cls.file_path = os.path.join(cls.temp_dir.name, ".env")
+        Path(cls.file_path).write_bytes(cls.env_data.encode())
 
-    def test_read_env(self):
-        file_path = os.path.join(self.temp_dir.name, ".env")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(self.env_data)
+        cls.subdir_path = os.path.join(cls.temp_dir.name, "subdir")
+        os.mkdir(cls.subdir_path)
+        Path(cls.subdir_path, ".env").write_bytes(cls.env_data.encode())
 
-        with patch("os.getcwd", return_value=self.temp_dir.name):
-            importlib.reload(newenvreader)
+    def setUp(self):
+        environ = patch.dict(os.environ, {"MY_VAR": "12121"})
+        environ.start()
+        self.addCleanup(environ.stop)
+        newenvreader._cwd_fn = lambda: self.temp_dir.name
+        self.addCleanup(setattr, newenvreader, "_cwd_fn", os.getcwd)
 
-            val = newenvreader.get_env("MY_VAR", cast=int)
-            assert val == 12121
+    def test_read_env(self):
+        newenvreader.load()
 
-            val = newenvreader.get_env("VAR1")
-            assert val == "value1"
+        val = newenvreader.get_env("MY_VAR", cast=int)
+        assert val == 12121
 
-            val = newenvreader.get_env("VAR1")
-            assert val == "value1"
+        val = newenvreader.get_env("VAR1")
+        assert val == "value1"
 
-        # Delete the temp file
-        os.remove(file_path)
+        val = newenvreader.get_env("VAR1")
+        assert val == "value1"
 
     def test_root_env_file(self):
-        subdir_path = os.path.join(self.temp_dir.name, "subdir")
-        os.mkdir(subdir_path)
+        newenvreader._cwd_fn = lambda: self.subdir_path
+        newenvreader.load()
+
+        val = newenvreader.get_env("MY_VAR", cast=float)
+        assert val == 12121
+
+        val = newenvreader.get_env("VAR1")
+        assert val == "value1"
 
-        file_path = os.path.join(subdir_path, ".env")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(self.env_data)
+        val = newenvreader.get_env("VAR3", cast=int)
+        assert val == 12121
 
-        with patch("os.getcwd", return_value=subdir_path):
-            importlib.reload(newenvreader)
+    def test_parent_env_file(self):
+        with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as child_dir:
+            nested_path = os.path.join(child_dir, "nested")
+            os.mkdir(nested_path)
 
-            val = newenvreader.get_env("MY_VAR", cast=float)
-            assert val == 12121
+            newenvreader._cwd_fn = lambda: nested_path
+            newenvreader.load()
 
             val = newenvreader.get_env("VAR1")
             assert val == "value1"
 
-            val = newenvreader.get_env("VAR3", cast=int)
-            assert val == 12121
+    def test_loaded_env_read_only(self):
+        newenvreader.load()
 
-        # Delete the temp file
-        os.remove(file_path)
+        with self.assertRaises(TypeError):
+            newenvreader.loaded_env["VAR1"] = "changed"
+        assert newenvreader.get_env("VAR1") == "value1"
 
     def test_parse_env_file_empty(self):
-        file_path = os.path.join(self.temp_dir.name, ".env")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(self.env_data)
-
-        with patch("os.getcwd", return_value=self.temp_dir.name):
-            importlib.reload(newenvreader)
+        newenvreader.load()
 
         val = newenvreader.get_env("MY_VAR", cast=int)
         assert val == 12121
 
-        os.remove(file_path)
-
     def test_ini_file(self):
         file_data = """
         [settings]
         VAR1=12
         VAR2=Value2
         """
-        file_path = os.path.join(self.temp_dir.name, "settings.ini")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(file_data)
+        with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as ini_dir:
+            file_path = os.path.join(ini_dir, "settings.ini")
+            Path(file_path).write_bytes(file_data.encode())
 
-        with patch("os.getcwd", return_value=self.temp_dir.name):
-            importlib.reload(newenvreader)
+            newenvreader._cwd_fn = lambda: ini_dir
+            newenvreader.load()
 
-        # assert newenvreader.get_env("VAR1", cast=int) == 12
-
-        os.remove(file_path)
+            # assert newenvreader.get_env("VAR1", cast=int) == 12
 
     def test_invalid_ini_file(self):
-        # Reload at start to clear any previous settings which don't get cleared
-        # when the module is reloaded as an exception is raised due to 
-        # invalid ini file
-        with patch("os.getcwd", return_value=self.temp_dir.name):
-            importlib.reload(newenvreader)
-        
-        file_data = """
-        VAR1=12121
-        VAR2=Value2
-        """
-        file_path = os.path.join(self.temp_dir.name, "settings.ini")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(file_data)
-
-        with patch("os.getcwd", return_value=self.temp_dir.name):
+        with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as ini_dir:
+            # Load at start to clear any previous settings which don't get
+            # cleared when loading fails as an exception is raised due to
+            # invalid ini file
+            newenvreader._cwd_fn = lambda: ini_dir
+            newenvreader.load()
+
+            file_data = """
+            VAR1=12121
+            VAR2=Value2
+            """
+            file_path = os.path.join(ini_dir, "settings.ini")
+            Path(file_path).write_bytes(file_data.encode())
+
+            parse = patch.object(
+                newenvreader, "parse_ini_file", wraps=newenvreader.parse_ini_file
+            )
+            # Treat every file as old enough to be cached
+            with parse as parse_ini_file, patch.object(newenvreader, "_RACY_NS", 0):
+                with self.assertRaises(ValueError):
+                    newenvreader.load()
+                # Loading the unchanged file again fails from the cache
+                with self.assertRaises(ValueError) as cached:
+                    newenvreader.load()
+                assert parse_ini_file.call_count == 1
+                assert isinstance(
+                    cached.exception.__cause__, MissingSectionHeaderError
+                )
+
+    def test_env_file_keys(self):
+        with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as env_dir:
+            file_path = os.path.join(env_dir, ".env")
+            Path(file_path).write_bytes(
+                "\ufeffA=1\nexport B=2\nC:D=3\n\u00e9=4\n".encode("utf-8")
+            )
+            assert newenvreader.parse_env_file(file_path) == {
+                "A": "1",
+                "export B": "2",
+                "C:D": "3",
+                "\u00e9": "4",
+            }
+
+            Path(file_path).write_bytes(b"A=1\nNO_SEPARATOR\n")
             with self.assertRaises(ValueError):
-                importlib.reload(newenvreader)
-    
-        os.remove(file_path)
+                newenvreader.parse_env_file(file_path)
+
+    def test_non_utf8_env_file(self):
+        with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as env_dir:
+            file_path = os.path.join(env_dir, ".env")
+            Path(file_path).write_bytes(b"A=\xff\n")
+
+            newenvreader._cwd_fn = lambda: env_dir
+            parse = patch.object(
+                newenvreader, "parse_env_file", wraps=newenvreader.parse_env_file
+            )
+            # Treat every file as old enough to be cached
+            with parse as parse_env_file, patch.object(newenvreader, "_RACY_NS", 0):
+                with self.assertRaises(UnicodeDecodeError) as first:
+                    newenvreader.load()
+                # The cached error is raised again unchanged
+                with self.assertRaises(UnicodeDecodeError) as second:
+                    newenvreader.load()
+                assert str(second.exception) == str(first.exception)
+                assert parse_env_file.call_count == 1
+
+                # Raising the cached error does not change the cached entry
+                try:
+                    raise RuntimeError("outer")
+                except RuntimeError:
+                    with self.assertRaises(UnicodeDecodeError):
+                        newenvreader.load()
+                with self.assertRaises(UnicodeDecodeError) as third:
+                    newenvreader.load()
+                assert third.exception is not second.exception
+                assert third.exception.__context__ is None
+                cached_err = newenvreader._PARSE_CACHE[file_path][1]
+                assert cached_err.__traceback__ is None
+
+    def test_changed_env_file(self):
+        with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as env_dir:
+            file_path = os.path.join(env_dir, ".env")
+            Path(file_path).write_bytes(b"VAR1=old\n")
+
+            newenvreader._cwd_fn = lambda: env_dir
+            newenvreader.load()
+            assert newenvreader.get_env("VAR1") == "old"
+
+            Path(file_path).write_bytes(b"VAR1=new value\n")
+            newenvreader.load()
+            assert newenvreader.get_env("VAR1") == "new value"
+
+    def test_changed_env_file_same_size(self):
+        with tempfile.TemporaryDirectory(dir=self.temp_dir.name) as env_dir:
+            file_path = os.path.join(env_dir, ".env")
+            Path(file_path).write_bytes(b"VAR1=old\n")
+            mtime_ns = os.stat(file_path).st_mtime_ns
+
+            newenvreader._cwd_fn = lambda: env_dir
+            parse = patch.object(
+                newenvreader, "parse_env_file", wraps=newenvreader.parse_env_file
+            )
+            # Treat every file as old enough to be cached
+            with parse as parse_env_file, patch.object(newenvreader, "_RACY_NS", 0):
+                newenvreader.load()
+                newenvreader.load()
+                assert newenvreader.get_env("VAR1") == "old"
+                assert parse_env_file.call_count == 1
+
+                # Rewrite with the same size once the change time moved on
+                # and restore the modification time
+                ctime_ns = os.stat(file_path).st_ctime_ns
+                while os.stat(file_path).st_ctime_ns == ctime_ns:
+                    Path(file_path).write_bytes(b"VAR1=new\n")
+                os.utime(file_path, ns=(mtime_ns, mtime_ns))
+                newenvreader.load()
+                assert newenvreader.get_env("VAR1") == "new"
+                assert parse_env_file.call_count == 2
+
+            # A recently modified file is re-read even if its metadata matches
+            with parse as parse_env_file:
+                Path(file_path).write_bytes(b"VAR1=old\n")
+                newenvreader.load()
+                Path(file_path).write_bytes(b"VAR1=new\n")
+                newenvreader.load()
+                assert newenvreader.get_env("VAR1") == "new"
+                assert parse_env_file.call_count == 2
+
+    def test_refresh(self):
+        newenvreader.load()
+
+        # Variables set after loading are read from os.environ
+        os.environ["MY_VAR"] = "42"
+        assert newenvreader.get_env("MY_VAR", cast=int) == 12121
+        os.environ["LATE_VAR"] = "late"
+        assert newenvreader.get_env("LATE_VAR") == "late"
 
-    def tearDown(self):
-        del os.environ["MY_VAR"]
-        self.temp_dir.cleanup()
+        newenvreader.refresh()
+        assert newenvreader.get_env("MY_VAR", cast=int) == 42
 
 
 class TestEnvParsing(unittest.TestCase):
-    def setUp(self):
-        os.environ["MY_VAR"] = "12121"
-        os.environ["KEY_NOT_OVERRIDDEN_BY_ENV"] = "Normal"
-
-        env_data = """STR_VAL=value1
+    _ENV_BYTES = b"""STR_VAL=value1
         StrVal=value2
         INT_VAL=12121
         FLOAT_VAL=32.1234
@@ -159,13 +276,20 @@ class TestEnvParsing(unittest.TestCase):
         VAL_HAS_MIXED_QUOTES_AS_DATA2='Y"
         """
 
+    def setUp(self):
+        environ = patch.dict(
+            os.environ, {"MY_VAR": "12121", "KEY_NOT_OVERRIDDEN_BY_ENV": "Normal"}
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+
         self.temp_dir = tempfile.TemporaryDirectory()
         file_path = os.path.join(self.temp_dir.name, ".env")
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(env_data)
+        Path(file_path).write_bytes(self._ENV_BYTES)
 
-        with patch("os.getcwd", return_value=self.temp_dir.name):
-            importlib.reload(newenvreader)
+        newenvreader._cwd_fn = lambda: self.temp_dir.name
+        self.addCleanup(setattr, newenvreader, "_cwd_fn", os.getcwd)
+        newenvreader.load()
         self.file_path = file_path
 
     def test_env_normal(self):
@@ -232,8 +356,6 @@ class TestEnvParsing(unittest.TestCase):
         assert newenvreader.get_env("VAL_HAS_MIXED_QUOTES_AS_DATA2") == '''\'Y"'''
 
     def tearDown(self):
-        del os.environ["MY_VAR"]
-        del os.environ["KEY_NOT_OVERRIDDEN_BY_ENV"]
         os.remove(self.file_path)
         self.temp_dir.cleanup()
 